@@ -52,10 +52,10 @@ MIDDLEWARE = [
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     # custom middlewares
-    "myapp.middleware.RequestResponseLoggerMiddleware",
+    "myapp.middleware.ClientIPMiddleware",
+    "myapp.middleware.TimingMiddleware",
     "myapp.middleware.SecurityMiddleware",
     "myapp.middleware.RateLimitingMiddleware",
-    "myapp.middleware.PerformanceMonitoringMiddleware",
     "myapp.middleware.CustomAuthenticationMiddleware",
     "myapp.middleware.IPWhitelistMiddleware",
     "myapp.middleware.CompressionMiddleware",
@@ -153,9 +153,24 @@ CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache",
         "LOCATION": "127.0.0.1:11211",
+        # Treat an unreachable memcached as a cache miss instead of a 500
+        "OPTIONS": {"ignore_exc": True},
     }
 }
 
+# Number of reverse proxies in front of the app that append to
+# X-Forwarded-For. myapp.middleware.ClientIPMiddleware takes the client IP
+# from that many entries from the right, since entries further left are
+# client-controlled. 0 ignores the header and uses REMOTE_ADDR.
+TRUSTED_PROXY_COUNT = 0
+
+# Redis instance backing myapp.middleware.RateLimitingMiddleware
+RATE_LIMIT_REDIS_URL = "redis://127.0.0.1:6379/0"
+
+# Addresses or CIDR blocks allowed by myapp.middleware.IPWhitelistMiddleware.
+# An empty list allows every client.
+IP_WHITELIST = []
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
 
@@ -1,37 +1,114 @@
-from django.utils.deprecation import MiddlewareMixin
+from collections import OrderedDict
+from functools import lru_cache, wraps
+import hashlib
+import ipaddress
 import logging
+import threading
 import time
-
-import gzip
+from types import MappingProxyType
+import weakref
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.cache import patch_vary_headers
+import redis
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Fastest available gzip backend; all expose the zlib compressobj API
+try:
+    from isal import isal_zlib as gzip_backend
+except ImportError:
+    try:
+        from zlib_ng import zlib_ng as gzip_backend
+    except ImportError:
+        import zlib as gzip_backend
 
 
 logger = logging.getLogger(__name__)
 
 
-class RequestResponseLoggerMiddleware(MiddlewareMixin):
+def gzip_level_for(backend):
     """
-    Middleware to log detailed information about each incoming request and response.
+    Return the default compression level for a gzip backend.
+
+    ISA-L only supports levels 0-3, so it uses its own default.
     """
+    return getattr(backend, "ISAL_DEFAULT_COMPRESSION", 6)
 
-    def __init__(self, get_response):
+
+def get_client_ip(request):
+    """
+    Return the client IP stamped by ClientIPMiddleware, or REMOTE_ADDR if it did not run.
+    """
+    return getattr(request, "client_ip", None) or request.META.get("REMOTE_ADDR")
+
+
+class ClientIPMiddleware:
+    """
+    Middleware to resolve the client IP once and stamp it on request.client_ip.
+    """
+
+    __slots__ = ("get_response", "trusted_proxy_count")
+
+    def __init__(self, get_response, trusted_proxy_count=None):
         self.get_response = get_response
+        if trusted_proxy_count is None:
+            trusted_proxy_count = getattr(settings, "TRUSTED_PROXY_COUNT", 0)
+        self.trusted_proxy_count = trusted_proxy_count
+
+    def __call__(self, request):
+        request.client_ip = self.resolve_client_ip(request)
+        return self.get_response(request)
 
-    def process_request(self, request):
+    def resolve_client_ip(self, request):
         """
-        Called before the view function is called.
+        Return the address the outermost trusted proxy received the request from.
+
+        Each proxy appends its peer to X-Forwarded-For, so only the rightmost
+        ``trusted_proxy_count`` entries can be trusted; anything further left
+        was sent by the client.
         """
-        request.start_time = time.time()
+        if self.trusted_proxy_count:
+            forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
+            if forwarded_for:
+                entries = forwarded_for.split(",")
+                if len(entries) >= self.trusted_proxy_count:
+                    return entries[-self.trusted_proxy_count].strip()
+        return request.META.get("REMOTE_ADDR")
+
+
+class RequestResponseLoggerMiddleware:
+    """
+    Middleware to log detailed information about each incoming request and response.
+    """
+
+    __slots__ = ("get_response",)
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.start_time = time.monotonic_ns()
         logger.info(
-            f"Incoming Request: {request.method} {request.path} from {request.META.get('REMOTE_ADDR')}"
+            "Incoming Request: %s %s from %s",
+            request.method,
+            request.path,
+            get_client_ip(request),
         )
 
-    def process_response(self, request, response):
-        """
-        Called just before Django sends the response to the client.
-        """
-        end_time = time.time()
+        response = self.get_response(request)
+
+        end_time = time.monotonic_ns()
         logger.info(
-            f"Outgoing Response: {response.status_code} {response['content-type']} in {end_time - request.start_time:.2f}s"
+            "Outgoing Response: %s %s in %.2fs",
+            response.status_code,
+            response.get("Content-Type"),
+            (end_time - request.start_time) / 1e9,
         )
         return response
 
@@ -41,215 +118,608 @@ class SecurityMiddleware:
     Middleware to implement security headers and enforce HSTS.
     """
 
+    __slots__ = ("get_response", "_headers")
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self._headers = (
+            ("Content-Security-Policy", "default-src 'self'"),
+            ("X-Content-Type-Options", "nosniff"),
+            ("Strict-Transport-Security", "max-age=31536000; includeSubDomains"),
+        )
 
     def __call__(self, request):
         response = self.get_response(request)
 
-        response["Content-Security-Policy"] = "default-src 'self'"
-        response["X-Content-Type-Options"] = "nosniff"
-
-        response["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
+        for header, value in self._headers:
+            response[header] = value
 
         return response
 
 
-class RateLimitingMiddleware(MiddlewareMixin):
+class _RateLimitStripe:
+    """
+    One shard of RateLimitingMiddleware state, guarded by its own lock.
+    """
+
+    __slots__ = ("lock", "maxsize", "ttl", "window_id", "shared", "pending")
+
+    def __init__(self, window_id, maxsize, ttl):
+        self.lock = threading.Lock()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.reset(window_id)
+
+    def reset(self, window_id):
+        self.window_id = window_id
+        # ip -> count across all processes, as of last flush. Bounded so a
+        # flood of distinct source IPs cannot grow it without limit.
+        self.shared = TTLCache(maxsize=self.maxsize, ttl=self.ttl)
+        # ip -> local increments not yet flushed, capped at maxsize entries
+        self.pending = {}
+
+
+class RateLimitingMiddleware:
     """
     Middleware to limit the number of requests a user can make within a specific time frame.
+
+    Decisions are made from in-process state: the last known shared counts
+    plus local increments. One background thread per process flushes the
+    local increments to a Redis hash every ``FLUSH_INTERVAL`` seconds, so
+    requests never wait on Redis. State is split into lock stripes by IP so
+    unrelated clients never contend.
     """
 
-    def __init__(self, get_response, limit=5, window=60):
+    __slots__ = (
+        "get_response",
+        "limit",
+        "window",
+        "max_tracked_ips",
+        "lock_timeout",
+        "_redis",
+        "_redis_ok",
+        "_stripes",
+        "__weakref__",
+    )
+
+    STRIPES = 64
+    FLUSH_INTERVAL = 0.02
+    # Socket timeouts (seconds) for the default Redis client, so a hung
+    # connection cannot stall the flush thread
+    REDIS_TIMEOUT = 0.5
+
+    def __init__(
+        self,
+        get_response,
+        limit=5,
+        window=60,
+        redis_client=None,
+        max_tracked_ips=100_000,
+        lock_timeout=0.001,
+    ):
         self.get_response = get_response
         self.limit = limit
         self.window = window
+        self.max_tracked_ips = max_tracked_ips
+        self.lock_timeout = lock_timeout
+
+        if redis_client is None:
+            redis_client = redis.Redis.from_url(
+                settings.RATE_LIMIT_REDIS_URL,
+                socket_timeout=self.REDIS_TIMEOUT,
+                socket_connect_timeout=self.REDIS_TIMEOUT,
+            )
+        self._redis = redis_client
+        self._redis_ok = True
 
-    def process_request(self, request):
-        """
-        Called before the view function is called.
-        """
-        # Your rate limiting logic here
-        pass
+        window_id = self.current_window_id()
+        self._stripes = [
+            _RateLimitStripe(window_id, max(1, max_tracked_ips // self.STRIPES), window)
+            for _ in range(self.STRIPES)
+        ]
+
+        _register_rate_limiter(self)
+
+    def __call__(self, request):
+        if not self.is_allowed(request):
+            return HttpResponse(status=429, headers={"Retry-After": str(self.window)})
+        return self.get_response(request)
+
+    def current_window_id(self):
+        """
+        Return the index of the fixed time window the current time falls in.
+        """
+        return int(time.time()) // self.window
+
+    def is_allowed(self, request):
+        """
+        Record the request and check it against the limit, without network I/O.
+        """
+        ip = get_client_ip(request)
+        if not ip:
+            # Nothing to key the limit on (e.g. a unix socket peer)
+            return True
+        window_id = self.current_window_id()
+        stripe = self._stripes[hash(ip) % self.STRIPES]
+
+        # Fail open: a contended stripe should not stall the middleware chain
+        if not stripe.lock.acquire(timeout=self.lock_timeout):
+            return True
+        try:
+            if window_id != stripe.window_id:
+                stripe.reset(window_id)
+
+            pending = stripe.pending.get(ip, 0)
+            if stripe.shared.get(ip, 0) + pending >= self.limit:
+                return False
+            if not pending and len(stripe.pending) >= stripe.maxsize:
+                # Fail open: flushes are not keeping up, so let new IPs
+                # through untracked rather than grow unflushed state
+                return True
+            stripe.pending[ip] = pending + 1
+            return True
+        finally:
+            stripe.lock.release()
+
+    def _flush(self):
+        """
+        Push local increments to Redis and refresh the shared counts they return.
+        """
+        batches = []
+        for stripe in self._stripes:
+            with stripe.lock:
+                if stripe.pending:
+                    batches.append((stripe, stripe.window_id, stripe.pending))
+                    stripe.pending = {}
+        if not batches:
+            return
+
+        pipe = self._redis.pipeline(transaction=False)
+        keys = set()
+        for _, window_id, pending in batches:
+            key = f"rl:{window_id}"
+            keys.add(key)
+            for ip, count in pending.items():
+                pipe.hincrby(key, ip, count)
+        for key in keys:
+            pipe.expire(key, self.window * 2)
+
+        try:
+            totals = pipe.execute()
+        except redis.RedisError:
+            # Fail open: keep deciding on local state until Redis is back
+            if self._redis_ok:
+                logger.warning("Rate limit flush to Redis failed", exc_info=True)
+            self._redis_ok = False
+            totals = None
+        else:
+            self._redis_ok = True
+
+        offset = 0
+        for stripe, window_id, pending in batches:
+            with stripe.lock:
+                if window_id != stripe.window_id:
+                    pass
+                elif totals is None:
+                    for ip, count in pending.items():
+                        stripe.shared[ip] = stripe.shared.get(ip, 0) + count
+                else:
+                    stripe.shared.update(
+                        zip(pending, totals[offset : offset + len(pending)])
+                    )
+            offset += len(pending)
+
+
+_rate_limiters = weakref.WeakSet()
+_rate_limiters_lock = threading.Lock()
+_rate_limit_flusher = None
 
-    def process_response(self, request, response):
-        """
-        Called just before Django sends the response to the client.
-        """
-        # Your rate limiting logic here
-        return response
+
+def _register_rate_limiter(limiter):
+    """
+    Add a RateLimitingMiddleware to the per-process flush thread, starting it once.
+    """
+    global _rate_limit_flusher
+    with _rate_limiters_lock:
+        _rate_limiters.add(limiter)
+        if _rate_limit_flusher is None:
+            _rate_limit_flusher = threading.Thread(
+                target=_flush_rate_limiters, name="rate-limit-flush", daemon=True
+            )
+            _rate_limit_flusher.start()
+
+
+def _flush_rate_limiters():
+    while True:
+        time.sleep(RateLimitingMiddleware.FLUSH_INTERVAL)
+        with _rate_limiters_lock:
+            limiters = list(_rate_limiters)
+        for limiter in limiters:
+            try:
+                limiter._flush()
+            except Exception:
+                logger.exception("Rate limit flush failed")
+        del limiters
 
 
-class PerformanceMonitoringMiddleware(MiddlewareMixin):
+class PerformanceMonitoringMiddleware:
     """
     Middleware to log the time taken by each view function.
     """
 
+    __slots__ = ("get_response",)
+
     def __init__(self, get_response):
         self.get_response = get_response
 
-    def process_view(self, request, view_func, view_args, view_kwargs):
-        """
-        Called just before Django calls the view function.
-        """
-        request.start_time = time.time()
+    def __call__(self, request):
+        # Overwritten by process_view once a view has been resolved
+        request.start_time = time.monotonic_ns()
 
-    def process_response(self, request, response):
-        """
-        Called just before Django sends the response to the client.
-        """
-        end_time = time.time()
+        response = self.get_response(request)
+
+        end_time = time.monotonic_ns()
 
         # Check if resolver_match is not None before accessing its attributes
         if request.resolver_match:
             logger.info(
-                f"View function '{request.resolver_match.url_name}' took {end_time - request.start_time:.2f}s"
+                "View function '%s' took %.2fs",
+                request.resolver_match.url_name,
+                (end_time - request.start_time) / 1e9,
             )
         else:
             logger.info(
-                f"No URL match found for the current request. Took {end_time - request.start_time:.2f}s"
+                "No URL match found for the current request. Took %.2fs",
+                (end_time - request.start_time) / 1e9,
             )
 
         return response
 
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """
+        Called just before Django calls the view function.
+        """
+        request.start_time = time.monotonic_ns()
 
-class CustomAuthenticationMiddleware(MiddlewareMixin):
+
+class TimingMiddleware:
     """
-    Middleware for custom authentication based on a special header.
+    Middleware combining request/response logging and performance monitoring,
+    timing each request once.
     """
 
+    __slots__ = ("get_response",)
+
     def __init__(self, get_response):
         self.get_response = get_response
 
-    def process_request(self, request):
-        """
-        Called before the view function is called.
-        """
-        # Your authentication logic here
-        pass
+    def __call__(self, request):
+        logger.info(
+            "Incoming Request: %s %s from %s",
+            request.method,
+            request.path,
+            get_client_ip(request),
+        )
+
+        start_time = time.monotonic_ns()
+        response = self.get_response(request)
+        end_time = time.monotonic_ns()
+
+        logger.info(
+            "Outgoing Response: %s %s in %.2fs",
+            response.status_code,
+            response.get("Content-Type"),
+            (end_time - start_time) / 1e9,
+        )
+
+        # Only set when the request reached a view, not when it was
+        # short-circuited (e.g. rate limited) or failed to resolve
+        view_start_time = getattr(request, "view_start_time", None)
+        if view_start_time is not None:
+            logger.info(
+                "View function '%s' took %.2fs",
+                request.resolver_match.url_name,
+                (end_time - view_start_time) / 1e9,
+            )
 
-    def process_response(self, request, response):
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
         """
-        Called just before Django sends the response to the client.
+        Called just before Django calls the view function.
         """
+        request.view_start_time = time.monotonic_ns()
+
+
+class CustomAuthenticationMiddleware:
+    """
+    Middleware for custom authentication based on a special header.
+    """
+
+    __slots__ = ("get_response",)
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
         # Your authentication logic here
-        return response
+        return self.get_response(request)
 
 
-class IPWhitelistMiddleware(MiddlewareMixin):
+class IPWhitelistMiddleware:
     """
     Middleware to allow or deny access based on IP whitelisting.
     """
 
+    __slots__ = ("get_response", "allowed_networks")
+
     def __init__(self, get_response, allowed_ips=None):
         self.get_response = get_response
-        self.allowed_ips = set(allowed_ips or [])
+        if allowed_ips is None:
+            allowed_ips = getattr(settings, "IP_WHITELIST", [])
+        # Entries may be single addresses or CIDR blocks like "10.0.0.0/8"
+        self.allowed_networks = tuple(
+            ipaddress.ip_network(ip, strict=False) for ip in allowed_ips
+        )
 
-    def process_request(self, request):
-        """
-        Called before the view function is called.
-        """
-        # Your IP whitelist logic here
-        pass
+    def __call__(self, request):
+        # An empty whitelist disables the check
+        if self.allowed_networks and not self.is_allowed(request):
+            return HttpResponseForbidden()
+        return self.get_response(request)
 
-    def process_response(self, request, response):
+    def is_allowed(self, request):
         """
-        Called just before Django sends the response to the client.
+        Check if the client address falls inside any whitelisted network.
         """
-        # Your IP whitelist logic here
-        return response
+        try:
+            address = ipaddress.ip_address(get_client_ip(request))
+        except ValueError:
+            return False
+        return any(address in network for network in self.allowed_networks)
 
-    def process_response(self, request, response):
-        """
-        Called just before Django sends the response to the client.
-        """
+
+def cache_compressed(view_func):
+    """
+    Mark a view's responses as shared content, so CompressionMiddleware
+    compresses identical bodies once and reuses the result.
+    """
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        response = view_func(request, *args, **kwargs)
+        response.cache_compressed = True
         return response
 
+    return wrapper
 
-class CompressionMiddleware(MiddlewareMixin):
+
+class CompressionMiddleware:
     """
     Middleware to compress responses for improved performance.
     """
 
-    def __init__(self, get_response):
+    __slots__ = (
+        "get_response",
+        "_gzip",
+        "_level",
+        "_cache",
+        "_cache_bytes",
+        "_cache_lock",
+    )
+
+    _COMPRESSIBLE = frozenset(
+        {
+            "text/html",
+            "text/css",
+            "application/javascript",
+            "application/json",
+            "text/plain",
+            "image/svg+xml",
+        }
+    )
+
+    # Limits for the cache of compressed bodies, keyed by a digest of the
+    # raw body: number of entries, total compressed bytes, and the largest
+    # raw body worth caching
+    CACHE_SIZE = 1024
+    CACHE_MAX_BYTES = 32 * 1024 * 1024
+    CACHE_MAX_BODY = 1024 * 1024
+
+    def __init__(self, get_response, gzip=None):
         self.get_response = get_response
+        self._gzip = gzip or gzip_backend
+        self._level = gzip_level_for(self._gzip)
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._cache_lock = threading.Lock()
 
-    def process_request(self, request):
-        """
-        Called before the view function is called.
-        """
-        request.supports_gzip = "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+    def __call__(self, request):
+        request.best_encoding = self.best_encoding(request)
 
-    def process_response(self, request, response):
+        response = self.get_response(request)
+
+        if self.is_compressible(response):
+            # The body depends on Accept-Encoding even when this client
+            # gets it uncompressed, so caches must key on it
+            patch_vary_headers(response, ("Accept-Encoding",))
+            if request.best_encoding:
+                response = self.compress_response(response, request.best_encoding)
+        return response
+
+    def best_encoding(self, request):
         """
-        Called just before Django sends the response to the client.
+        Pick the preferred encoding the client accepts: brotli, then gzip.
         """
-        if self.should_compress(request, response):
-            response = self.compress_response(response)
-        return response
+        accepted = set()
+        for token in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+            coding, _, params = token.partition(";")
+            if not self.is_refused(params):
+                accepted.add(coding.strip().lower())
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
 
-    def should_compress(self, request, response):
+    def is_refused(self, params):
         """
-        Check if the response should be compressed.
+        Check if Accept-Encoding parameters carry q=0, i.e. "not acceptable".
         """
-        return getattr(request, "supports_gzip", False) and self.is_compressible(
-            response
-        )
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    return float(value) == 0
+                except ValueError:
+                    return False
+        return False
 
     def is_compressible(self, response):
         """
         Check if the response content is compressible.
         """
-        content_type = response.get("Content-Type", "").lower()
-        return (
-            "text/html" in content_type
-            or "text/css" in content_type
-            or "application/javascript" in content_type
-        )
+        # Streaming responses have no .content, and an existing
+        # Content-Encoding means the body is already compressed.
+        if response.streaming or response.has_header("Content-Encoding"):
+            return False
+
+        content_type = response.get("Content-Type", "").split(";", 1)[0].strip().lower()
+        if content_type not in self._COMPRESSIBLE:
+            return False
 
-    def compress_response(self, response):
+        # Not worth compressing small responses
+        return len(response.content) >= 200
+
+    def compress_response(self, response, encoding="gzip"):
         """
-        Compress the response content using gzip.
+        Compress the response content using brotli or gzip.
         """
-        content = response.content
+        # Never compress twice, e.g. when stacked with GZipMiddleware
+        if getattr(response, "_compression_applied", False) or response.has_header(
+            "Content-Encoding"
+        ):
+            return response
 
-        if isinstance(content, str):
-            content = content.encode("utf-8")
+        # HttpResponse.content is always bytes (already encoded with
+        # response.charset), so no str check is needed here.
+        content = response.content
+        if self.is_cacheable(response):
+            compressed_content = self.cached_compress(content, encoding)
+        else:
+            compressed_content = self.compress(content, encoding)
 
-        compressed_content = gzip.compress(content)
+        # The content setter stores bytes as-is (no copy), so there is no
+        # gain in writing to the private response._container instead
         response.content = compressed_content
 
-        response["Content-Encoding"] = "gzip"
+        response["Content-Encoding"] = encoding
+        response._compression_applied = True
         response["Content-Length"] = str(len(compressed_content))
 
         return response
 
+    def is_cacheable(self, response):
+        """
+        Check if the response opted in via cache_compressed and is small enough.
+        """
+        return (
+            getattr(response, "cache_compressed", False)
+            and len(response.content) <= self.CACHE_MAX_BODY
+        )
+
+    def cached_compress(self, content, encoding):
+        """
+        Compress raw bytes, reusing the result for identical bodies.
+        """
+        key = (encoding, hashlib.blake2b(content, digest_size=16).digest())
+
+        with self._cache_lock:
+            compressed_content = self._cache.get(key)
+            if compressed_content is not None:
+                self._cache.move_to_end(key)
+                return compressed_content
+
+        compressed_content = self.compress(content, encoding)
+        with self._cache_lock:
+            if key not in self._cache:
+                self._cache[key] = compressed_content
+                self._cache_bytes += len(compressed_content)
+            while (
+                len(self._cache) > self.CACHE_SIZE
+                or self._cache_bytes > self.CACHE_MAX_BYTES
+            ):
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted)
+        return compressed_content
+
+    def compress(self, content, encoding):
+        """
+        Compress raw bytes with the given encoding.
+        """
+        if encoding == "br":
+            return brotli.compress(content, quality=4)
+        # wbits=31 writes gzip framing directly, without the BytesIO
+        # wrapper used by gzip.compress
+        compressor = self._gzip.compressobj(self._level, self._gzip.DEFLATED, 31)
+        return compressor.compress(content) + compressor.flush()
 
-class CacheControlMiddleware(MiddlewareMixin):
+
+def _cache_control_header(settings):
+    """
+    Build the Cache-Control header string based on the provided settings.
+    """
+    parts = []
+    if "max_age" in settings:
+        parts.append(f'max-age={settings["max_age"]}')
+    if "public" in settings and settings["public"]:
+        parts.append("public")
+    if "no_cache" in settings and settings["no_cache"]:
+        parts.append("no-cache")
+    if "no_store" in settings and settings["no_store"]:
+        parts.append("no-store")
+
+    return ", ".join(parts)
+
+
+@lru_cache(maxsize=128)
+def _cached_cache_control_header(items):
+    """
+    Build the Cache-Control header string, memoized on the settings items.
+    """
+    return _cache_control_header(dict(items))
+
+
+# Shared read-only default, so no dict is allocated per request
+DEFAULT_CACHE_CONTROL = MappingProxyType(
+    {
+        "max_age": 3600,  # Cache for 1 hour
+        "public": True,  # Allow caching by public caches
+        "no_cache": False,  # Allow caching but revalidate with the server
+        "no_store": False,  # Allow caching but do not store a cached copy
+    }
+)
+DEFAULT_CACHE_CONTROL_HEADER = _cache_control_header(DEFAULT_CACHE_CONTROL)
+
+
+class CacheControlMiddleware:
     """
     Middleware to add Cache-Control headers for caching strategies.
     """
 
+    __slots__ = ("get_response",)
+
     def __init__(self, get_response):
         self.get_response = get_response
 
-    def process_request(self, request):
-        """
-        Called before the view function is called.
-        """
+    def __call__(self, request):
         # Your cache control logic here (if needed)
-        # For example, you might want to set specific cache headers based on the request
-        request.custom_cache_control = {
-            "max_age": 3600,  # Cache for 1 hour
-            "public": True,  # Allow caching by public caches
-            "no_cache": False,  # Allow caching but revalidate with the server
-            "no_store": False,  # Allow caching but do not store a cached copy
-        }
+        # Views can override this with e.g.
+        # request.custom_cache_control = {**DEFAULT_CACHE_CONTROL, "max_age": 60}
+        request.custom_cache_control = DEFAULT_CACHE_CONTROL
+
+        response = self.get_response(request)
 
-    def process_response(self, request, response):
-        """
-        Called just before Django sends the response to the client.
-        """
         # Your cache control logic here (if needed)
         cache_control_settings = getattr(request, "custom_cache_control", None)
 
@@ -265,14 +735,10 @@ class CacheControlMiddleware(MiddlewareMixin):
         """
         Build the Cache-Control header string based on the provided settings.
         """
-        parts = []
-        if "max_age" in settings:
-            parts.append(f'max-age={settings["max_age"]}')
-        if "public" in settings and settings["public"]:
-            parts.append("public")
-        if "no_cache" in settings and settings["no_cache"]:
-            parts.append("no-cache")
-        if "no_store" in settings and settings["no_store"]:
-            parts.append("no-store")
-
-        return ", ".join(parts)
+        if settings is DEFAULT_CACHE_CONTROL:
+            return DEFAULT_CACHE_CONTROL_HEADER
+        try:
+            return _cached_cache_control_header(frozenset(settings.items()))
+        except TypeError:
+            # Overrides with unhashable values cannot be memoized
+            return _cache_control_header(settings)
@@ -1,3 +1,413 @@
-from django.test import TestCase
+import gzip
+import importlib
+from unittest import mock
 
-# Create your tests here.
+import brotli
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase
+import redis
+
+from myapp.middleware import (
+    DEFAULT_CACHE_CONTROL,
+    CacheControlMiddleware,
+    ClientIPMiddleware,
+    CompressionMiddleware,
+    IPWhitelistMiddleware,
+    RateLimitingMiddleware,
+    TimingMiddleware,
+    cache_compressed,
+)
+
+BODY = b"<p>" + b"book " * 200 + b"</p>"
+
+
+def html_view(request):
+    return HttpResponse(BODY, content_type="text/html; charset=utf-8")
+
+
+def ok_view(request):
+    return HttpResponse("ok")
+
+
+class CompressionSkipTests(TestCase):
+    def get(self, view):
+        middleware = CompressionMiddleware(view)
+        return middleware(RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip"))
+
+    def test_skips_small_bodies(self):
+        response = self.get(
+            lambda request: HttpResponse(b"<p>short</p>", content_type="text/html")
+        )
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.content, b"<p>short</p>")
+
+    def test_skips_streaming_responses(self):
+        response = self.get(
+            lambda request: StreamingHttpResponse([BODY], content_type="text/html")
+        )
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(b"".join(response.streaming_content), BODY)
+
+    def test_skips_already_encoded_responses(self):
+        def view(request):
+            response = html_view(request)
+            response["Content-Encoding"] = "br"
+            return response
+
+        response = self.get(view)
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(response.content, BODY)
+
+
+class CompressionBackendTests(TestCase):
+    def test_gzip_round_trip_for_each_backend(self):
+        for name in ("isal.isal_zlib", "zlib_ng.zlib_ng", "zlib"):
+            try:
+                backend = importlib.import_module(name)
+            except ImportError:
+                continue
+            with self.subTest(backend=name):
+                middleware = CompressionMiddleware(html_view, gzip=backend)
+                request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip")
+                response = middleware(request)
+
+                self.assertEqual(response["Content-Encoding"], "gzip")
+                self.assertEqual(gzip.decompress(response.content), BODY)
+
+
+class TimingMiddlewareTests(TestCase):
+    def test_logs_request_response_and_view_time(self):
+        def get_response(request):
+            middleware.process_view(request, html_view, (), {})
+            request.resolver_match = mock.Mock(url_name="book_list")
+            return html_view(request)
+
+        middleware = TimingMiddleware(get_response)
+        request = RequestFactory().get("/books/", REMOTE_ADDR="1.2.3.4")
+        with self.assertLogs("myapp.middleware", "INFO") as logs:
+            middleware(request)
+
+        incoming, outgoing, view = logs.records
+        # Arguments are passed through for lazy %-formatting
+        self.assertEqual(incoming.msg, "Incoming Request: %s %s from %s")
+        self.assertEqual(incoming.args, ("GET", "/books/", "1.2.3.4"))
+        self.assertEqual(outgoing.msg, "Outgoing Response: %s %s in %.2fs")
+        self.assertEqual(outgoing.args[:2], (200, "text/html; charset=utf-8"))
+        self.assertEqual(view.msg, "View function '%s' took %.2fs")
+        self.assertEqual(view.args[0], "book_list")
+        self.assertLessEqual(view.args[1], outgoing.args[2])
+
+    def test_no_view_time_when_view_not_reached(self):
+        middleware = TimingMiddleware(lambda request: HttpResponse(status=429))
+        with self.assertLogs("myapp.middleware", "INFO") as logs:
+            middleware(RequestFactory().get("/"))
+
+        self.assertEqual(len(logs.records), 2)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def hincrby(self, key, field, amount):
+        self.commands.append(("hincrby", key, field, amount))
+
+    def expire(self, key, seconds):
+        self.commands.append(("expire", key, seconds))
+
+    def execute(self):
+        if self.client.down:
+            raise redis.ConnectionError("Redis is down")
+        results = []
+        for command, key, *args in self.commands:
+            if command == "hincrby":
+                field, amount = args
+                bucket = self.client.hashes.setdefault(key, {})
+                bucket[field] = bucket.get(field, 0) + amount
+                results.append(bucket[field])
+            else:
+                results.append(True)
+        return results
+
+
+class FakeRedis:
+    def __init__(self):
+        self.hashes = {}
+        self.down = False
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+# Flushes are driven by the tests, not the background thread
+@mock.patch("myapp.middleware._register_rate_limiter", mock.Mock())
+class RateLimitingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.factory = RequestFactory()
+
+    def make_middleware(self, limit=3, window=60, **kwargs):
+        return RateLimitingMiddleware(
+            ok_view, limit=limit, window=window, redis_client=self.redis, **kwargs
+        )
+
+    def get(self, middleware, ip="1.2.3.4"):
+        return middleware(self.factory.get("/", REMOTE_ADDR=ip))
+
+    def ips_by_stripe(self, middleware):
+        stripes = {}
+        for n in range(1, 255):
+            ip = f"10.0.0.{n}"
+            stripes.setdefault(hash(ip) % middleware.STRIPES, []).append(ip)
+        return list(stripes.values())
+
+    def stripe_for(self, middleware, ip):
+        return middleware._stripes[hash(ip) % middleware.STRIPES]
+
+    def test_denies_after_limit(self):
+        middleware = self.make_middleware(limit=3)
+
+        codes = [self.get(middleware).status_code for _ in range(4)]
+
+        self.assertEqual(codes, [200, 200, 200, 429])
+        self.assertEqual(self.get(middleware)["Retry-After"], "60")
+        # Other clients are unaffected
+        self.assertEqual(self.get(middleware, ip="5.6.7.8").status_code, 200)
+
+    def test_window_rollover_resets_counts(self):
+        with mock.patch("myapp.middleware.time.time", return_value=59):
+            middleware = self.make_middleware(limit=1)
+            self.assertEqual(self.get(middleware).status_code, 200)
+            self.assertEqual(self.get(middleware).status_code, 429)
+
+        with mock.patch("myapp.middleware.time.time", return_value=60):
+            self.assertEqual(self.get(middleware).status_code, 200)
+
+    def test_counts_from_other_processes_apply_after_flush(self):
+        middleware = self.make_middleware(limit=3)
+        self.redis.hashes[f"rl:{middleware.current_window_id()}"] = {"1.2.3.4": 2}
+
+        self.assertEqual(self.get(middleware).status_code, 200)
+        middleware._flush()
+
+        self.assertEqual(self.get(middleware).status_code, 429)
+
+    def test_redis_down_falls_back_to_local_counts(self):
+        middleware = self.make_middleware(limit=3)
+        self.redis.down = True
+
+        self.get(middleware)
+        self.get(middleware)
+        with self.assertLogs("myapp.middleware", "WARNING") as logs:
+            middleware._flush()
+            middleware._flush()
+        self.assertEqual(len(logs.records), 1)
+
+        self.assertEqual(self.get(middleware).status_code, 200)
+        self.assertEqual(self.get(middleware).status_code, 429)
+
+    def test_request_without_client_ip_is_not_counted(self):
+        middleware = self.make_middleware(limit=1)
+        request = self.factory.get("/")
+        del request.META["REMOTE_ADDR"]
+
+        self.assertEqual(middleware(request).status_code, 200)
+        self.assertEqual(middleware(request).status_code, 200)
+        middleware._flush()
+        self.assertEqual(self.redis.hashes, {})
+
+    def test_new_ips_pass_untracked_when_pending_is_full(self):
+        middleware = self.make_middleware(limit=1, max_tracked_ips=1)
+        first, second = next(
+            ips for ips in self.ips_by_stripe(middleware) if len(ips) > 1
+        )[:2]
+
+        self.assertEqual(self.get(middleware, ip=first).status_code, 200)
+        self.assertEqual(self.get(middleware, ip=second).status_code, 200)
+        self.assertEqual(self.get(middleware, ip=second).status_code, 200)
+
+        self.assertEqual(self.stripe_for(middleware, first).pending, {first: 1})
+
+    def test_flush_maps_totals_back_across_stripes(self):
+        middleware = self.make_middleware(limit=100)
+        ips = [stripe_ips[0] for stripe_ips in self.ips_by_stripe(middleware)[:3]]
+        key = f"rl:{middleware.current_window_id()}"
+        # Distinct counts from other processes expose any offset mix-up
+        self.redis.hashes[key] = {ip: 10 * (i + 1) for i, ip in enumerate(ips)}
+
+        for i, ip in enumerate(ips):
+            for _ in range(i + 1):
+                self.get(middleware, ip=ip)
+        middleware._flush()
+
+        for i, ip in enumerate(ips):
+            stripe = self.stripe_for(middleware, ip)
+            self.assertEqual(stripe.shared[ip], 11 * (i + 1))
+            self.assertEqual(stripe.pending, {})
+
+    def test_fewer_tracked_ips_than_stripes(self):
+        middleware = self.make_middleware(limit=100, max_tracked_ips=32)
+
+        self.assertEqual(self.get(middleware).status_code, 200)
+        middleware._flush()
+
+        self.assertEqual(self.stripe_for(middleware, "1.2.3.4").shared["1.2.3.4"], 1)
+
+
+class IPWhitelistMiddlewareTests(TestCase):
+    def setUp(self):
+        self.middleware = IPWhitelistMiddleware(
+            ok_view, allowed_ips=["10.0.0.0/8", "192.168.1.5", "2001:db8::/32"]
+        )
+
+    def get(self, ip):
+        return self.middleware(RequestFactory().get("/", REMOTE_ADDR=ip))
+
+    def test_allows_addresses_inside_whitelisted_networks(self):
+        for ip in ("10.1.2.3", "192.168.1.5", "2001:db8::1"):
+            with self.subTest(ip=ip):
+                self.assertEqual(self.get(ip).status_code, 200)
+
+    def test_denies_addresses_outside_whitelisted_networks(self):
+        for ip in ("11.0.0.1", "192.168.1.6", "2001:db9::1"):
+            with self.subTest(ip=ip):
+                self.assertEqual(self.get(ip).status_code, 403)
+
+    def test_denies_unparsable_addresses(self):
+        self.assertEqual(self.get("not-an-ip").status_code, 403)
+
+    def test_empty_whitelist_allows_everyone(self):
+        middleware = IPWhitelistMiddleware(ok_view, allowed_ips=[])
+        request = RequestFactory().get("/", REMOTE_ADDR="11.0.0.1")
+        self.assertEqual(middleware(request).status_code, 200)
+
+
+class CompressionEncodingTests(TestCase):
+    def get(self, accept_encoding):
+        middleware = CompressionMiddleware(html_view)
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING=accept_encoding)
+        return middleware(request)
+
+    def test_identity_when_nothing_supported_is_accepted(self):
+        response = self.get("deflate")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.content, BODY)
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+
+    def test_gzip_round_trip(self):
+        response = self.get("gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), BODY)
+
+    def test_prefers_brotli(self):
+        response = self.get("gzip, deflate, br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.content), BODY)
+
+    def test_respects_q_zero(self):
+        response = self.get("br;q=0, gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+
+        response = self.get("gzip; q=0.0, identity")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+        response = self.get("gzip;q=0.5")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+
+
+class CompressionCacheTests(TestCase):
+    def make_stack(self, view):
+        # Same order as settings.MIDDLEWARE: CacheControlMiddleware runs
+        # inside CompressionMiddleware and marks every response public
+        return CompressionMiddleware(CacheControlMiddleware(view))
+
+    def get(self, stack):
+        return stack(RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip"))
+
+    def test_caches_only_opted_in_views(self):
+        stack = self.make_stack(html_view)
+        self.get(stack)
+        self.assertEqual(len(stack._cache), 0)
+
+        stack = self.make_stack(cache_compressed(html_view))
+        first = self.get(stack)
+        second = self.get(stack)
+        self.assertEqual(len(stack._cache), 1)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(gzip.decompress(second.content), BODY)
+
+    def test_cache_is_bounded_by_bytes(self):
+        with mock.patch.object(CompressionMiddleware, "CACHE_MAX_BYTES", 0):
+            stack = self.make_stack(cache_compressed(html_view))
+            self.get(stack)
+
+        self.assertEqual(len(stack._cache), 0)
+        self.assertEqual(stack._cache_bytes, 0)
+
+
+class CompressionIdempotencyTests(TestCase):
+    def setUp(self):
+        self.middleware = CompressionMiddleware(html_view)
+
+    def test_compressing_twice_compresses_once(self):
+        response = self.middleware.compress_response(html_view(None), "gzip")
+        compressed = response.content
+
+        response = self.middleware.compress_response(response, "gzip")
+        self.assertEqual(response.content, compressed)
+
+        # The marker alone also guards against a second pass
+        del response["Content-Encoding"]
+        response = self.middleware.compress_response(response, "gzip")
+        self.assertEqual(response.content, compressed)
+        self.assertEqual(gzip.decompress(response.content), BODY)
+
+    def test_existing_content_encoding_is_left_alone(self):
+        response = html_view(None)
+        response["Content-Encoding"] = "br"
+
+        response = self.middleware.compress_response(response, "gzip")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(response.content, BODY)
+
+
+class CacheControlMiddlewareTests(TestCase):
+    def test_default_header(self):
+        response = CacheControlMiddleware(ok_view)(RequestFactory().get("/"))
+        self.assertEqual(response["Cache-Control"], "max-age=3600, public")
+
+    def test_view_override(self):
+        def view(request):
+            request.custom_cache_control = {
+                **DEFAULT_CACHE_CONTROL,
+                "max_age": 60,
+                "public": ["unhashable"],
+            }
+            return ok_view(request)
+
+        response = CacheControlMiddleware(view)(RequestFactory().get("/"))
+        self.assertEqual(response["Cache-Control"], "max-age=60, public")
+
+
+class ClientIPMiddlewareTests(TestCase):
+    def resolve(self, trusted_proxy_count, **meta):
+        middleware = ClientIPMiddleware(lambda request: None, trusted_proxy_count)
+        request = RequestFactory().get("/", REMOTE_ADDR="10.0.0.1", **meta)
+        return middleware.resolve_client_ip(request)
+
+    def test_ignores_forwarded_for_without_trusted_proxies(self):
+        ip = self.resolve(0, HTTP_X_FORWARDED_FOR="1.1.1.1")
+        self.assertEqual(ip, "10.0.0.1")
+
+    def test_uses_entry_appended_by_trusted_proxy(self):
+        # The client sent "6.6.6.6"; the proxy appended the real peer
+        ip = self.resolve(1, HTTP_X_FORWARDED_FOR="6.6.6.6, 2.2.2.2")
+        self.assertEqual(ip, "2.2.2.2")
+
+        ip = self.resolve(2, HTTP_X_FORWARDED_FOR="6.6.6.6, 2.2.2.2, 3.3.3.3")
+        self.assertEqual(ip, "2.2.2.2")
+
+    def test_falls_back_to_remote_addr_with_too_few_entries(self):
+        ip = self.resolve(2, HTTP_X_FORWARDED_FOR="2.2.2.2")
+        self.assertEqual(ip, "10.0.0.1")
@@ -1,11 +1,17 @@
 # views.py
 from django.shortcuts import render
+from django.views.decorators.cache import cache_page
 
+from .middleware import cache_compressed
 
+BOOKS = [
+    {"title": "Book 1", "author": "Author 1"},
+    {"title": "Book 2", "author": "Author 2"},
+    {"title": "Book 3", "author": "Author 3"},
+]
+
+
+@cache_compressed
+@cache_page(60 * 60)
 def book_list(request):
-    books = [
-        {"title": "Book 1", "author": "Author 1"},
-        {"title": "Book 2", "author": "Author 2"},
-        {"title": "Book 3", "author": "Author 3"},
-    ]
-    return render(request, "book_list.html", {"books": books})
+    return render(request, "book_list.html", {"books": BOOKS})